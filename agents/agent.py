@@ -1,11 +1,17 @@
-from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnableSequence
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
 from langchain_google_genai import ChatGoogleGenerativeAI
+import hashlib
+import logging
 import os
 from dotenv import load_dotenv
 from uuid import uuid4
+from concurrent.futures import Future
 import asyncio
-from typing import List, Optional
+import queue
+import weakref
+from typing import AsyncIterator, Iterator, List, Optional
+from agents.loop import BackgroundLoop
+from utils import LRUCache, compress_query
 from models.a2a import (
     A2AMessage, TaskResult, TaskStatus, Artifact,
     MessagePart, MessageConfiguration
@@ -13,33 +19,73 @@ from models.a2a import (
 
 load_dotenv()
 
-apikey = os.environ["GEMINI_API_KEY"]
+logger = logging.getLogger(__name__)
+
+_APIKEY = None
+
+def _get_apikey() -> Optional[str]:
+    """Read GEMINI_API_KEY once, when the first agent is built rather than at import."""
+    global _APIKEY
+    if _APIKEY is None:
+        _APIKEY = os.environ.get("GEMINI_API_KEY")
+    return _APIKEY
+
+# Static instructions. Sent as the first message of every prompt so the prefix
+# stays byte-stable across turns and Gemini's prompt caching can reuse it.
+SYSTEM_PROMPT = """You are Studly, a study planner.
+Output a structured plan in markdown:
+# Duration: [days/weeks]
+## Daily Goals: [list milestones]
+## Time Estimates: [per day]
+# Tips: [motivational advice]
+If unrelated to studying, politely decline and suggest a study plan query. Concise (under 400 words)."""
+
+# Once a context's committed history reaches this many messages it is
+# compacted, keeping roughly COMPACT_KEEP_RATIO of the turns verbatim.
+COMPACT_THRESHOLD = 20
+COMPACT_KEEP_RATIO = 0.4
+
+# Most messages echoed back in a TaskResult's history
+HISTORY_CAP_MESSAGES = 20
+
+# Most contexts kept in memory; the least recently used is evicted first
+MAX_CONTEXTS = 1024
+
+# Replies cached for history-free queries (retried deliveries, replayed demos)
+PLAN_CACHE_SIZE = 2048
+
+# Most Gemini calls (plans and streams) in flight at once per process
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+
+GENERATION_ERROR_MESSAGE = "I encountered an issue generating the study plan. Please try again."
+EMPTY_INPUT_MESSAGE = "I couldn't find a question in your message. Could you rephrase it, e.g. \"7-day Python study plan\"?"
 
 class StudlyAgent:
-    def __init__(self, ):
-            self.study_contexts = {}
+    def __init__(
+        self,
+        system_prompt: str = SYSTEM_PROMPT,
+        model: str = "gemini-2.5-flash",
+        temperature: float = 0.3
+    ):
+            self.study_contexts = LRUCache(maxsize=MAX_CONTEXTS)
             self.llm = ChatGoogleGenerativeAI(
-                model="gemini-2.5-flash",
-                google_api_key=apikey,
-                temperature=0.3,
+                model=model,
+                google_api_key=_get_apikey(),
+                temperature=temperature,
                 max_retries=3,
                 # max_output_tokens=400  
             )
-            self.prompt_template = PromptTemplate(
-                input_variables=["query"],
-                template=(
-                    """You are Studly, a study planner. Query: {query}
-                        Output a structured plan in markdown:
-                        # Duration: [days/weeks]
-                        ## Daily Goals: [list milestones]
-                        ## Time Estimates: [per day]
-                        # Tips: [motivational advice]
-                        If unrelated to studying, politely decline and suggest a study plan query. Concise (under 400 words).
-                        """
-                    
-                )
-            )
-            self.chain = self.prompt_template | self.llm
+            self.plan_cache = LRUCache(maxsize=PLAN_CACHE_SIZE)
+            # Built once; the prompt is a plain message list sent straight to
+            # the model, with no PromptTemplate/RunnableSequence per call
+            self.system_message = SystemMessage(content=system_prompt)
+            # All agent work runs on one background loop; sync callers block on it
+            self.loop = BackgroundLoop()
+            self.llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+            # One lock per active context; entries vanish once no request holds them
+            self.context_locks = weakref.WeakValueDictionary()
+            # Turns currently generating, keyed by (scope, task or context id, query, use_cache)
+            self.inflight_turns = {}
     
     def process_messages(
         self,
@@ -47,39 +93,66 @@ class StudlyAgent:
         context_id: Optional[str] = None,
         task_id: Optional[str] = None,
         config: Optional[MessageConfiguration] = None
+    ) -> TaskResult:
+        """Blocking wrapper around aprocess_messages for sync (WSGI) callers."""
+        return self.submit_messages(messages, context_id, task_id, config).result()
+
+    def submit_messages(
+        self,
+        messages: List[A2AMessage],
+        context_id: Optional[str] = None,
+        task_id: Optional[str] = None,
+        config: Optional[MessageConfiguration] = None
+    ) -> Future:
+        """Schedule aprocess_messages on the agent loop without waiting for it."""
+        return self.loop.run(
+            self.aprocess_messages(messages, context_id, task_id, config)
+        )
+
+    async def aprocess_messages(
+        self,
+        messages: List[A2AMessage],
+        context_id: Optional[str] = None,
+        task_id: Optional[str] = None,
+        config: Optional[MessageConfiguration] = None
     ) -> TaskResult:
         """Process incoming messages and return a personalized study plan."""
 
-        # Generate IDs if not provided
+        # Generate IDs if not provided. A retried delivery repeats the caller's
+        # task id (the messageId on message/send) but not the context id, which
+        # Telex never sends, so in-flight turns are matched on the task when
+        # the caller gave one
         context_id = context_id or str(uuid4())
+        turn_scope = ("task", task_id) if task_id else ("context", context_id)
         task_id = task_id or str(uuid4())
 
-        # Get last user message
-        user_message = messages[-1] if messages else None
-        if not user_message:
-            raise ValueError("No message provided")
+        user_text = self._extract_user_text(messages)
+        if not user_text:
+            # Nothing to plan: answer right away without touching history or Gemini
+            return self._input_required_result(task_id, context_id)
 
-        # Extract text input
-        user_text = ""
-        for part in user_message.parts:
-            if part.kind == "text":
-                user_text = part.text.strip()
-                break
+        # Strip filler before it costs input tokens
+        query = compress_query(user_text)
+        use_cache = not (config and config.bypass_cache)
 
-        if not user_text:
-            raise ValueError("User input is empty")
+        # An identical turn already in flight for this task or context shares
+        # its reply instead of generating and committing twice
+        key = (*turn_scope, query, use_cache)
+        turn = self.inflight_turns.get(key)
+        if turn is None:
+            turn = asyncio.ensure_future(self._run_turn(context_id, query, use_cache))
+            self.inflight_turns[key] = turn
+            turn.add_done_callback(lambda _: self.inflight_turns.pop(key, None))
+        # Shielded so one caller going away doesn't cancel the shared turn
+        study_plan = await asyncio.shield(turn)
 
-        # Retrieve past context (if any)
-        history = self.study_contexts.get(context_id, [])
-        
-        study_plan = self._generate_study_plan(user_text)
-        # Cache this interaction
-        self.study_contexts[context_id] = history + [user_text]
+        # One frozen part shared by the reply and the artifact
+        text_part = MessagePart(kind="text", text=study_plan)
 
         # Build response
         response_message = A2AMessage(
             role="agent",
-            parts=[MessagePart(kind="text", text=study_plan)],
+            parts=[text_part],
             taskId=task_id
         )
 
@@ -87,12 +160,16 @@ class StudlyAgent:
         artifacts = [
             Artifact(
                 name="study_plan",
-                parts=[MessagePart(kind="text", text=study_plan)]
+                parts=[text_part]
             )
         ]
 
-        # Combine conversation history
-        full_history = messages + [response_message]
+        # Combine conversation history, slicing only the tail that survives the cap
+        overflow = len(messages) + 1 - HISTORY_CAP_MESSAGES
+        if overflow > 0:
+            full_history = messages[overflow:] + [response_message]
+        else:
+            full_history = [*messages, response_message]
 
         return TaskResult(
             id=task_id,
@@ -105,13 +182,168 @@ class StudlyAgent:
             history=full_history
         )
         
-    def _generate_study_plan(self, query: str) -> str:
-        """Call Gemini model via LangChain asynchronously."""
+    async def _run_turn(self, context_id: str, query: str, use_cache: bool) -> str:
+        """Generate a reply against the context's history and commit the turn."""
+        # Turns on one context run one at a time so each sees the previous reply
+        async with self._context_lock(context_id):
+            # Committed turns for this context (append-only, never rewritten)
+            history = self.study_contexts.get(context_id, [])
+
+            study_plan = await self._generate_study_plan(query, history, use_cache=use_cache)
+            if study_plan is None:
+                return GENERATION_ERROR_MESSAGE
+            self._commit_turn(context_id, query, study_plan)
+            return study_plan
+
+    def stream_study_plan(
+        self,
+        messages: List[A2AMessage],
+        context_id: Optional[str] = None
+    ) -> Iterator[str]:
+        """Validate the input now and return an iterator over plan chunks as Gemini streams them."""
+        context_id = context_id or str(uuid4())
+        user_text = self._extract_user_text(messages)
+        if not user_text:
+            return iter([EMPTY_INPUT_MESSAGE])
+        query = compress_query(user_text)
+        return self._stream_study_plan(context_id, query)
+
+    def _stream_study_plan(self, context_id: str, query: str) -> Iterator[str]:
+        """Bridge _astream_turn on the agent loop to a blocking iterator for WSGI."""
+        chunks = queue.Queue()
+        done = object()
+
+        async def produce():
+            try:
+                async for chunk in self._astream_turn(context_id, query):
+                    chunks.put(chunk)
+            finally:
+                chunks.put(done)
+
+        future = self.loop.run(produce())
         try:
-            response = self.chain.invoke({"query": query})
-            return response.content if hasattr(response, "content") else str(response)
+            while (chunk := chunks.get()) is not done:
+                yield chunk
+            future.result()
+        finally:
+            # Client went away mid-stream: stop a generation that is still running
+            future.cancel()
+
+    async def _astream_turn(self, context_id: str, query: str) -> AsyncIterator[str]:
+        """Stream a reply under the context lock and LLM limit, then commit the turn."""
+        async with self._context_lock(context_id):
+            history = self.study_contexts.get(context_id, [])
+            prompt = [self.system_message, *history, HumanMessage(content=query)]
+            chunks = []
+            try:
+                async with self.llm_semaphore:
+                    async for chunk in self.llm.astream(prompt):
+                        if chunk.content:
+                            chunks.append(chunk.content)
+                            yield chunk.content
+            except Exception as e:
+                logger.error("Gemini error: %s", e)
+                yield GENERATION_ERROR_MESSAGE
+                return
+
+            self._commit_turn(context_id, query, "".join(chunks))
+
+    def _extract_user_text(self, messages: List[A2AMessage]) -> str:
+        """Return the stripped text of the last message ("" if it has none).
+
+        Raises ValueError if there is no message at all.
+        """
+        # Get last user message
+        user_message = messages[-1] if messages else None
+        if not user_message:
+            raise ValueError("No message provided")
+
+        # Extract text input (first text part)
+        user_text = next(
+            (part.text.strip() for part in (user_message.parts or ()) if part.kind == "text" and part.text),
+            ""
+        )
+        return user_text
+
+    def _input_required_result(self, task_id: str, context_id: str) -> TaskResult:
+        """Ask the user to rephrase a message that has no usable text."""
+        return TaskResult(
+            id=task_id,
+            contextId=context_id,
+            status=TaskStatus(
+                state="input-required",
+                message=A2AMessage(
+                    role="agent",
+                    parts=[MessagePart(kind="text", text=EMPTY_INPUT_MESSAGE)],
+                    taskId=task_id
+                )
+            )
+        )
+
+    def _context_lock(self, context_id: str) -> asyncio.Lock:
+        """Return the lock for a context, creating it if no request holds one."""
+        # Only called on the agent loop, so get-then-set cannot race
+        lock = self.context_locks.get(context_id)
+        if lock is None:
+            lock = self.context_locks[context_id] = asyncio.Lock()
+        return lock
+
+    def _commit_turn(self, context_id: str, query: str, study_plan: str):
+        """Append a successful (user, agent) turn to the context's cached prefix."""
+        # Extend in place: re-concatenating would copy the whole history every turn
+        history = self.study_contexts.setdefault(context_id, [])
+        history.append(HumanMessage(content=query))
+        history.append(AIMessage(content=study_plan))
+        if len(history) >= COMPACT_THRESHOLD:
+            history[:] = self._compact_history(history)
+
+    async def _generate_study_plan(
+        self,
+        query: str,
+        history: List[BaseMessage],
+        use_cache: bool = True
+    ) -> Optional[str]:
+        """Call Gemini with the stable prefix (system + history) followed by the new query.
+
+        Returns None if the model call fails.
+        """
+        # Without history the reply depends only on the query, so repeats can skip Gemini
+        cache_key = None
+        if use_cache and not history:
+            cache_key = hashlib.blake2b(query.lower().encode(), digest_size=16).hexdigest()
+            cached = self.plan_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        prompt = [self.system_message, *history, HumanMessage(content=query)]
+        try:
+            async with self.llm_semaphore:
+                response = await self.llm.ainvoke(prompt)
+            plan = response.content if hasattr(response, "content") else str(response)
+            if cache_key:
+                self.plan_cache[cache_key] = plan
+            return plan
 
         except Exception as e:
-            print(f"Gemini error: {e}")
-            return "I encountered an issue generating the study plan. Please try again."
-        
\ No newline at end of file
+            logger.error("Gemini error: %s", e)
+            return None
+
+    def _compact_history(self, history: List[BaseMessage]) -> List[BaseMessage]:
+        """Drop low-signal turns from history, keeping the survivors verbatim.
+
+        The newest (user, agent) turn is always kept, so the next request
+        sees the reply it follows. Older turns compete for the remaining
+        slots, scored by the length of the user text weighted by recency.
+        No extra model call is made and kept messages are never rewritten,
+        so their tokens stay cacheable.
+        """
+        turns = [history[i:i + 2] for i in range(0, len(history), 2)]
+        keep = max(1, int(len(turns) * COMPACT_KEEP_RATIO))
+        last = len(turns) - 1
+
+        def score(index: int) -> float:
+            return len(turns[index][0].content) * (index + 1) / len(turns)
+
+        older = sorted(range(last), key=score, reverse=True)[:keep - 1]
+        kept = sorted(older) + [last]
+        return [message for index in kept for message in turns[index]]
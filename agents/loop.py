@@ -0,0 +1,37 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine
+
+
+class BackgroundLoop:
+    """An asyncio event loop on a daemon thread, started lazily in each process.
+
+    Sync (WSGI) request threads schedule coroutines here, so awaited Gemini
+    calls from many requests overlap on one loop.
+    """
+
+    __slots__ = ("_lock", "_pid", "_loop")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+
+    def run(self, coro: Coroutine[Any, Any, Any]) -> Future:
+        """Schedule a coroutine from any thread; returns a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        # Threads don't survive a fork (gunicorn workers), so start the
+        # loop in whichever process first schedules work.
+        if self._pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="studly-loop", daemon=True).start()
+                self._loop = loop
+                self._pid = os.getpid()
+        return self._loop
@@ -1,122 +1,344 @@
-from flask import Flask, request, jsonify, Response
-from models.a2a import JSONRPCRequest, JSONRPCResponse, TaskResult, TaskStatus, Artifact, MessagePart, A2AMessage
-from agents.agent import StudlyAgent
-import json
+from flask import Flask, request, Response
+from flask.json.provider import JSONProvider
+from models.a2a import ExecuteParams, MessageParams, JSONRPCResponse, TaskResult, TaskStatus, Artifact, MessagePart, A2AMessage, MessageConfiguration
+from agents.agent import EMPTY_INPUT_MESSAGE, StudlyAgent
+import logging
+import re
+import threading
+import orjson
 from flask_cors import CORS
 from utils import normalize_telex_message
 from pydantic import ValidationError
 from uuid import uuid4  # For generating IDs in raw mode
-from typing import Dict, Any  # For type hints
+from typing import Callable, Dict, Any, List, Optional, Tuple  # For type hints
+from datetime import datetime, timezone
+from functools import lru_cache, partial
+
+class ORJSONProvider(JSONProvider):
+    """Routes Flask's own JSON handling (jsonify, get_json, extensions) through orjson."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
-agent = StudlyAgent()
+_agent: Optional[StudlyAgent] = None
+_agent_lock = threading.Lock()
+
+def get_agent() -> StudlyAgent:
+    """The process-wide StudlyAgent, built on first use so importing the app needs no API key.
+
+    Built under a lock: concurrent first requests must share one agent, or
+    turns committed to the losing instances would be lost.
+    """
+    global _agent
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                _agent = StudlyAgent()
+    return _agent
+
+AGENT_CARD = {
+    "name": "Studly",
+    "description": "The Study Plan Generator is an AI-driven assistant that creates personalized, adaptive study schedules based on a user's goals, available time, and preferred learning style.",
+    "url": "__URL__",
+    "version": "1.0",
+    "capabilities":{
+        "streaming": True,
+        "pushNotifications": False
+    },
+    "skills": [
+        {
+            "name": "generate_study_plan",
+            "description": "Creates personalized study plans based on user input."
+        }
+    ]
+}
+# Serialized once at import; only the host URL is spliced in per request
+AGENT_CARD_TEMPLATE = orjson.dumps(AGENT_CARD)
+
+def _error_template(code: int, message: str) -> bytes:
+    return orjson.dumps({
+        "jsonrpc": "2.0",
+        "id": "__ID__",
+        "error": {"code": code, "message": message}
+    })
+
+# JSON-RPC methods served by /tasks/send and /tasks/sendSubscribe
+ALLOWED_METHODS = frozenset({"message/send", "execute"})
+
+# Most calls accepted in one JSON-RPC batch; each one is an agent turn that
+# holds the request thread until it finishes
+MAX_BATCH_SIZE = 20
+
+def is_valid_id(request_id: Any) -> bool:
+    """JSON-RPC ids are strings, integers or null."""
+    return request_id is None or (isinstance(request_id, (str, int)) and not isinstance(request_id, bool))
+
+ERROR_NO_BODY = _error_template(-32600, "Invalid Request: No JSON body")
+ERROR_INVALID_REQUEST = _error_template(-32600, "Invalid Request: jsonrpc must be '2.0', and id (string, integer or null) and method are required")
+ERROR_METHOD_NOT_FOUND = _error_template(-32601, "Method not found")
+ERROR_INVALID_PARAMS = _error_template(-32602, "Invalid params")
+ERROR_BATCH_TOO_LARGE = _error_template(-32600, f"Invalid Request: a batch may hold at most {MAX_BATCH_SIZE} calls")
+ERROR_PARSE = _error_template(-32700, "Parse error: body is not valid JSON")
+
+def error_payload(template: bytes, request_id: Any) -> bytes:
+    """Splice the request id into a pre-serialized JSON-RPC error."""
+    return template.replace(b'"__ID__"', orjson.dumps(request_id))
+
+def error_response(template: bytes, request_id: Any, status: int) -> Response:
+    return Response(error_payload(template, request_id), status=status, mimetype="application/json")
 
 @app.route("/")
 def home():
     return "Server is live"
 
+@lru_cache(maxsize=16)
+def agent_card_body(url: str) -> bytes:
+    """Agent card bytes for a host; a deployment only ever sees a handful of hosts."""
+    return AGENT_CARD_TEMPLATE.replace(b'"__URL__"', orjson.dumps(url))
+
 @app.route("/.well-known/agent.json",methods=["GET"])
 def agent_card():
-    metadata = {
-        "name": "Studly",
-        "description": "The Study Plan Generator is an AI-driven assistant that creates personalized, adaptive study schedules based on a user's goals, available time, and preferred learning style.",
-        "url": request.host_url.rstrip('/'),
-        "version": "1.0",
-        "capabilities":{
-            "streaming": False,
-            "pushNotifications": False
-        },
-        "skills": [
-            {
-                "name": "generate_study_plan",
-                "description": "Creates personalized study plans based on user input."
-            }
-        ]
+    return Response(agent_card_body(request.host_url.rstrip('/')), mimetype="application/json")
+
+# Empty-input reply (same text as the agent's) serialized once; per-request
+# ids and timestamp are spliced in
+_FALLBACK_RESULT = TaskResult(
+    id="__TID__",
+    contextId="__CID__",
+    status=TaskStatus(
+        state="input-required",
+        timestamp="__TS__",
+        message=A2AMessage(
+            role="agent",
+            parts=[MessagePart(kind="text", text=EMPTY_INPUT_MESSAGE)],
+            messageId="__MID__",
+            taskId="__TID__"
+        )
+    )
+)
+FALLBACK_TEMPLATE = _FALLBACK_RESULT.model_dump_json().encode()
+FALLBACK_RPC_TEMPLATE = JSONRPCResponse(id="__ID__", result=_FALLBACK_RESULT).model_dump_json().encode()
+
+# All fallback placeholders, substituted in one pass so a client value that
+# happens to equal a placeholder is never scanned (and replaced) again
+FALLBACK_PLACEHOLDER_RE = re.compile(rb'"__(ID|TID|CID|MID|TS)__"')
+
+def fallback_payload(body: Dict[str, Any], task_id: Optional[str], context_id: Optional[str]) -> bytes:
+    """Reply to an empty request without calling the agent."""
+    values = {
+        b"TID": orjson.dumps(task_id or str(uuid4())),
+        b"CID": orjson.dumps(context_id or str(uuid4())),
+        b"MID": orjson.dumps(str(uuid4())),
+        b"TS": orjson.dumps(datetime.now(timezone.utc).isoformat()),
     }
-    metadata_json = json.dumps(metadata, indent=2)
-    return Response(metadata_json, mimetype="application/json")
+    if "jsonrpc" in body:
+        payload = FALLBACK_RPC_TEMPLATE
+        values[b"ID"] = orjson.dumps(body["id"])
+    else:
+        payload = FALLBACK_TEMPLATE
+    return FALLBACK_PLACEHOLDER_RE.sub(lambda m: values[m.group(1)], payload)
 
-@app.route("/tasks/send", methods=["POST"])
-def a2a_endpoint():
-    """Main A2A Endpoint"""
-    try:
-        body: Dict[str, Any] = request.get_json()
-        if body is None:
-            return jsonify({
-                "jsonrpc": "2.0",
-                "id": None,
-                "error": {
-                    "code": -32600,
-                    "message": "Invalid Request: No JSON body"
-                }
-            }), 400
-        
-        # Log raw body for debugging Telex payloads
-        app.logger.info(f"Raw Telex body: {json.dumps(body, indent=2)}")
-        
-        print(body)  # Your debug print
+def fallback_response(body: Dict[str, Any], task_id: Optional[str], context_id: Optional[str]) -> Response:
+    return Response(fallback_payload(body, task_id, context_id), mimetype="application/json")
 
-        # Handle both JSON-RPC and raw Task (for testers/A2A spec compliance)
-        if "jsonrpc" in body:
-            # JSON-RPC mode (your existing logic)
-            if body.get("jsonrpc") != "2.0" or "id" not in body:
-                return jsonify({
-                    "jsonrpc": "2.0",
-                    "id": body.get("id"),
-                    "error": {
-                        "code": -32600,
-                        "message": "Invalid Request: jsonrpc must be '2.0' and id is required"
-                    }
-                }), 400
-
-            rpc_request = JSONRPCRequest(**body)
-
-            # Extract messages
-            messages = []
-            context_id = None
-            task_id = None
-            config = None
-            
-            if rpc_request.method == "message/send":
-                raw_message = rpc_request.params.message
-                config = rpc_request.params.configuration
+class InvalidTaskRequest(Exception):
+    """Raised while parsing a task request; carries a pre-serialized error."""
+
+    def __init__(self, template: bytes, request_id: Any, status: int):
+        super().__init__(template)
+        self.template = template
+        self.request_id = request_id
+        self.status = status
+
+    def to_payload(self) -> bytes:
+        return error_payload(self.template, self.request_id)
+
+    def to_response(self) -> Response:
+        return error_response(self.template, self.request_id, self.status)
+
+def parse_task_request(body: Dict[str, Any]) -> Tuple[List[A2AMessage], Optional[str], Optional[str], Optional[MessageConfiguration]]:
+    """Extract (messages, context_id, task_id, config) from a JSON-RPC or raw Task body."""
+    # Log raw body for debugging Telex payloads (formatted lazily, only at DEBUG)
+    debug = app.logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        app.logger.debug("Raw Telex body: %s", orjson.dumps(body).decode())
+
+    # Extract messages
+    messages = []
+    context_id = None
+    task_id = None
+    config = None
+
+    # Handle both JSON-RPC and raw Task (for testers/A2A spec compliance)
+    if "jsonrpc" in body:
+        # JSON-RPC mode (your existing logic)
+        try:
+            rpc_version, request_id, method = body["jsonrpc"], body["id"], body["method"]
+        except KeyError:
+            request_id = body.get("id")
+            raise InvalidTaskRequest(ERROR_INVALID_REQUEST, request_id if is_valid_id(request_id) else None, 400)
+        # The id is echoed into responses built without validation, so it is
+        # checked here; an id that can't be echoed is answered with null
+        if not is_valid_id(request_id):
+            raise InvalidTaskRequest(ERROR_INVALID_REQUEST, None, 400)
+        if rpc_version != "2.0":
+            raise InvalidTaskRequest(ERROR_INVALID_REQUEST, request_id, 400)
+        if not isinstance(method, str) or method not in ALLOWED_METHODS:
+            raise InvalidTaskRequest(ERROR_METHOD_NOT_FOUND, request_id, 404)
+
+        # Check the envelope first, then validate only the params model the
+        # method needs instead of trying every member of the params Union
+        params = body.get("params") or {}
+        try:
+            if method == "message/send":
+                message_params = MessageParams.model_validate(params)
+                raw_message = message_params.message
+                config = message_params.configuration
                 
                 # Call the normalizer for Telex format
                 messages = normalize_telex_message(raw_message)
                 
                 task_id = raw_message.messageId
-            elif rpc_request.method == "execute":
-                messages = rpc_request.params.messages
-                context_id = rpc_request.params.contextId
-                task_id = rpc_request.params.taskId
             else:
-                return jsonify({
-                    "jsonrpc": "2.0",
-                    "id": rpc_request.id,
-                    "error": {"code": -32601, "message": "Method not found"}
-                }), 404
-        else:
-            # Raw Task mode (for testers) - parse directly with your models
-            messages = body.get('messages', []) or []
-            context_id = body.get('contextId')
-            task_id = body.get('id') or str(uuid4())
-            config = body.get('config', None)  # Or whatever config field
-
-            # If single message, normalize for Telex-like structure
-            if messages and len(messages) == 1:
-                raw_message = {'parts': messages[0].get('parts', [])}
-                messages = [normalize_telex_message(raw_message)[0]] if normalize_telex_message(raw_message) else messages
-
-        print(messages)  # Debug: Should now show list of A2AMessage
-        
+                execute_params = ExecuteParams.model_validate(params)
+                messages = execute_params.messages
+                context_id = execute_params.contextId
+                task_id = execute_params.taskId
+        except ValidationError:
+            raise InvalidTaskRequest(ERROR_INVALID_PARAMS, request_id, 400)
+    else:
+        # Raw Task mode (for testers) - parse directly with your models
+        messages = body.get('messages', []) or []
+        context_id = body.get('contextId')
+        task_id = body.get('id') or str(uuid4())
+        if body.get('config'):
+            try:
+                config = MessageConfiguration.model_validate(body['config'])
+            except ValidationError:
+                request_id = body.get('id')
+                raise InvalidTaskRequest(ERROR_INVALID_PARAMS, request_id if is_valid_id(request_id) else None, 400)
+
+        # If single message, normalize for Telex-like structure
+        if messages and len(messages) == 1:
+            raw_message = {'parts': messages[0].get('parts', [])}
+            messages = [normalize_telex_message(raw_message)[0]] if normalize_telex_message(raw_message) else messages
+
+    if debug:
+        app.logger.debug("Normalized messages: %s", messages)
+    
+    if not messages:
+        # Fallback if normalizer returns empty (rare, but safe)
+        app.logger.warning("Normalizer returned empty messages - using fallback")
+
+    return messages, context_id, task_id, config
+
+def internal_error_payload(body: Any, e: Exception) -> bytes:
+    request_id = body.get("id") if isinstance(body, dict) else None
+    if not is_valid_id(request_id):
+        request_id = None
+    app.logger.error(
+        f"A2A endpoint error - ID: {request_id if isinstance(body, dict) else 'N/A'}, "
+        f"Method: {body.get('method') if isinstance(body, dict) else 'N/A'}, "
+        f"Exception: {str(e)}",
+        exc_info=True  # Includes full traceback
+    )
+    return orjson.dumps({
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {
+            "code": -32603,
+            "message": "Internal error",
+            "data": {"details": str(e)}
+        }
+    })
+
+def internal_error_response(body: Any, e: Exception) -> Response:
+    return Response(internal_error_payload(body, e), status=500, mimetype="application/json")
+
+def rpc_result_payload(request_id: Any, result: TaskResult) -> bytes:
+    # model_construct skips re-validation: the id is echoed from the
+    # checked envelope and the result was built by the agent. Untrusted
+    # input must keep going through full validation.
+    response = JSONRPCResponse.model_construct(
+        id=request_id,
+        result=result
+    )
+    return response.model_dump_json().encode()
+
+def start_batch_call(item: Any) -> Callable[[], bytes]:
+    """Parse one batch entry and schedule it on the agent loop.
+
+    Returns a callable that blocks for the entry's serialized response.
+    """
+    if not isinstance(item, dict) or "jsonrpc" not in item:
+        return partial(error_payload, ERROR_INVALID_REQUEST, None)
+    try:
+        messages, context_id, task_id, config = parse_task_request(item)
         if not messages:
-            # Fallback if normalizer returns empty (rare, but safe)
-            app.logger.warning("Normalizer returned empty messages - using fallback")
-            fallback_message = A2AMessage(role="user", parts=[MessagePart(kind="text", text="Please provide a study topic.")])
-            messages = [fallback_message]
+            return partial(fallback_payload, item, task_id, context_id)
+
+        future = get_agent().submit_messages(
+            messages=messages,
+            context_id=context_id,
+            task_id=task_id,
+            config=config
+        )
+    except InvalidTaskRequest as e:
+        return e.to_payload
+    except Exception as e:
+        # Serialized (and logged) now, while the traceback is current
+        payload = internal_error_payload(item, e)
+        return lambda: payload
+
+    def finish() -> bytes:
+        try:
+            return rpc_result_payload(item["id"], future.result())
+        except Exception as e:
+            return internal_error_payload(item, e)
+
+    return finish
+
+def batch_response(batch: List[Any]) -> Response:
+    """Answer a JSON-RPC batch; every call is scheduled before any result is awaited."""
+    if not batch:
+        return error_response(ERROR_INVALID_REQUEST, None, 400)
+    if len(batch) > MAX_BATCH_SIZE:
+        return error_response(ERROR_BATCH_TOO_LARGE, None, 400)
+    # Scheduled up front so the calls overlap on the agent loop
+    pending = [start_batch_call(item) for item in batch]
+    payload = b"[" + b",".join(finish() for finish in pending) + b"]"
+    return Response(payload, mimetype="application/json")
+
+@app.route("/tasks/send", methods=["POST"])
+def a2a_endpoint():
+    """Main A2A Endpoint"""
+    body = None
+    try:
+        data = request.get_data()
+        if not data:
+            return error_response(ERROR_NO_BODY, None, 400)
+        try:
+            body: Dict[str, Any] = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return error_response(ERROR_PARSE, None, 400)
 
-        result = agent.process_messages(
+        # A top-level array is a JSON-RPC batch
+        if isinstance(body, list):
+            return batch_response(body)
+        if not isinstance(body, dict):
+            return error_response(ERROR_INVALID_REQUEST, None, 400)
+
+        messages, context_id, task_id, config = parse_task_request(body)
+        if not messages:
+            return fallback_response(body, task_id, context_id)
+
+        result = get_agent().process_messages(
                 messages=messages,
                 context_id=context_id,
                 task_id=task_id,
@@ -125,33 +347,63 @@ def a2a_endpoint():
 
         # Return JSON-RPC for RPC mode, raw TaskResult for raw mode
         if "jsonrpc" in body:
-            response = JSONRPCResponse(
-                id=body["id"],
-                result=result
-            )
-            return jsonify(response.model_dump())
+            return Response(rpc_result_payload(body["id"], result), mimetype="application/json")
         else:
-            # Raw Task response - update and return TaskResult
-            result.id = task_id
-            result.status.state = "completed"
-            return jsonify(result.model_dump())
+            # Raw Task response - the agent already set id and state
+            return Response(result.model_dump_json(), mimetype="application/json")
 
+    except InvalidTaskRequest as e:
+        return e.to_response()
     except Exception as e:
-        app.logger.error(
-        f"A2A endpoint error - ID: {body.get('id') if 'body' in locals() else 'N/A'}, "
-        f"Method: {body.get('method') if 'body' in locals() else 'N/A'}, "
-        f"Exception: {str(e)}",
-        exc_info=True  # Includes full traceback
-    )
-        return jsonify({
-            "jsonrpc": "2.0",
-            "id": body.get("id") if "body" in locals() else None,
-            "error": {
-                "code": -32603,
-                "message": "Internal error",
-                "data": {"details": str(e)}
-            }
-        }), 500
+        return internal_error_response(body, e)
+
+# SSE frames; only the JSON-encoded stream id (%b) varies per connection
+SSE_WORKING_FRAME = b'data: {"id":%b,"status":{"state":"working"}}\n\n'
+SSE_CHUNK_PREFIX = b'data: {"id":%b,"chunk":'
+SSE_DONE_FRAME = b"data: [DONE]\n\n"
+
+@app.route("/tasks/sendSubscribe", methods=["POST"])
+def a2a_stream_endpoint():
+    """Streaming A2A Endpoint: Server-Sent Events with plan chunks as Gemini emits them"""
+    body = None
+    try:
+        data = request.get_data()
+        if not data:
+            return error_response(ERROR_NO_BODY, None, 400)
+        try:
+            body: Dict[str, Any] = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return error_response(ERROR_PARSE, None, 400)
+        if not isinstance(body, dict):
+            # Batches can't share one event stream
+            return error_response(ERROR_INVALID_REQUEST, None, 400)
+
+        messages, context_id, task_id, config = parse_task_request(body)
+        task_id = task_id or str(uuid4())
+        stream_id = body.get("id") or task_id
+
+        if not messages:
+            chunks = iter([EMPTY_INPUT_MESSAGE])
+        else:
+            # Validates the input up front so errors still return a JSON response
+            chunks = get_agent().stream_study_plan(messages, context_id=context_id)
+
+    except InvalidTaskRequest as e:
+        return e.to_response()
+    except Exception as e:
+        return internal_error_response(body, e)
+
+    def generate_stream():
+        # Frames are built as bytes: the id is encoded once per stream and
+        # each chunk only needs its own string escaped
+        encoded_id = orjson.dumps(stream_id)
+        yield SSE_WORKING_FRAME % encoded_id
+        chunk_prefix = SSE_CHUNK_PREFIX % encoded_id
+        for chunk in chunks:
+            yield chunk_prefix + orjson.dumps(chunk) + b'}\n\n'
+        yield SSE_DONE_FRAME
+
+    return Response(generate_stream(), mimetype="text/event-stream")
         
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
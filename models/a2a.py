@@ -1,15 +1,31 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import Literal, Optional, List, Dict, Any, Union
 from datetime import datetime, timezone
 from uuid import uuid4
+import sys
+
+# Message-level models are immutable once built: instances can be shared
+# between the reply, artifacts and history without defensive copies.
+FROZEN = ConfigDict(frozen=True)
 
 class MessagePart(BaseModel):
+    model_config = FROZEN
+
     kind: Literal["text", "data", "file"]
     text: Optional[str] = None
     data: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]] = None
     file_url: Optional[str] = None
 
+    @field_validator("kind")
+    @classmethod
+    def _intern_kind(cls, v: str) -> str:
+        # Parsed JSON yields fresh str objects; interning lets `kind == "text"`
+        # checks hit CPython's identity fast path instead of comparing bytes.
+        return sys.intern(v)
+
 class A2AMessage(BaseModel):
+    model_config = FROZEN
+
     kind: Literal["message"] = "message"
     role: Literal["user", "agent", "system"]
     parts: List[MessagePart]
@@ -26,6 +42,7 @@ class MessageConfiguration(BaseModel):
     blocking: bool = True
     acceptedOutputModes: List[str] = ["text/plain", "image/png", "image/svg+xml"]
     pushNotificationConfig: Optional[PushNotificationConfig] = None
+    bypass_cache: bool = False
 
 class MessageParams(BaseModel):
     message: A2AMessage
@@ -36,18 +53,16 @@ class ExecuteParams(BaseModel):
     taskId: Optional[str] = None
     messages: List[A2AMessage]
 
-class JSONRPCRequest(BaseModel):
-    jsonrpc: Literal["2.0"]
-    id: str
-    method: Literal["message/send", "execute"]
-    params: Union[MessageParams, ExecuteParams, Dict[str, Any]] = Field(default_factory=dict)  # Fallback dict
-
 class TaskStatus(BaseModel):
+    model_config = FROZEN
+
     state: Literal["working", "completed", "input-required", "failed"]
     timestamp: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     message: Optional[A2AMessage] = None
 
 class Artifact(BaseModel):
+    model_config = FROZEN
+
     artifactId: str = Field(default_factory=lambda: str(uuid4()))
     name: str
     parts: List[MessagePart]
@@ -62,6 +77,6 @@ class TaskResult(BaseModel):
 
 class JSONRPCResponse(BaseModel):
     jsonrpc: Literal["2.0"] = "2.0"
-    id: str
+    id: Optional[Union[str, int]]
     result: Optional[TaskResult] = None
     error: Optional[Dict[str, Any]] = None
\ No newline at end of file
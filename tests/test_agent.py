@@ -0,0 +1,38 @@
+import unittest
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from agents.agent import COMPACT_KEEP_RATIO, COMPACT_THRESHOLD, StudlyAgent
+
+
+class CompactHistoryTest(unittest.TestCase):
+    def setUp(self):
+        # _compact_history needs no model client, so skip __init__
+        self.agent = StudlyAgent.__new__(StudlyAgent)
+
+    def test_keeps_newest_turn_even_when_short(self):
+        history = []
+        for i in range(COMPACT_THRESHOLD // 2 - 1):
+            history += [HumanMessage(content=f"long question {i} " * 20), AIMessage(content=f"plan {i}")]
+        history += [HumanMessage(content="hi"), AIMessage(content="newest reply")]
+
+        compacted = self.agent._compact_history(history)
+
+        self.assertEqual(compacted[-2].content, "hi")
+        self.assertEqual(compacted[-1].content, "newest reply")
+        self.assertEqual(len(compacted), 2 * int(len(history) // 2 * COMPACT_KEEP_RATIO))
+
+    def test_kept_turns_stay_in_order(self):
+        history = []
+        for i in range(COMPACT_THRESHOLD // 2):
+            history += [HumanMessage(content="q" * (i % 3 + 1) + str(i)), AIMessage(content=str(i))]
+
+        compacted = self.agent._compact_history(history)
+
+        replies = [int(message.content) for message in compacted[1::2]]
+        self.assertEqual(replies, sorted(replies))
+        self.assertEqual(replies[-1], COMPACT_THRESHOLD // 2 - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
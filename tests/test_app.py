@@ -0,0 +1,118 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+import orjson
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# The model client is replaced below; it only needs a key to be constructed
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+import app as app_module
+
+
+class StubChatModel(BaseChatModel):
+    """Echoes the query; lower-numbered topics answer last, so results finish out of order."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        query = messages[-1].content
+        await asyncio.sleep(0.05 / (int(query.rsplit(" ", 1)[-1]) + 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"plan for {query}"))])
+
+
+def send_call(request_id, text):
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "method": "message/send",
+        "params": {"message": {"role": "user", "parts": [{"kind": "text", "text": text}]}},
+    }
+
+
+class BatchEndpointTest(unittest.TestCase):
+    def setUp(self):
+        self.agent = app_module.get_agent()
+        self.agent.llm = StubChatModel()
+        self.client = app_module.app.test_client()
+
+    def post(self, body):
+        response = self.client.post("/tasks/send", json=body)
+        return response, orjson.loads(response.data)
+
+    def test_results_follow_request_order(self):
+        batch = [send_call(f"req-{i}", f"topic {i}") for i in range(10)]
+
+        response, replies = self.post(batch)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([reply["id"] for reply in replies], [f"req-{i}" for i in range(10)])
+        for i, reply in enumerate(replies):
+            self.assertEqual(reply["result"]["status"]["message"]["parts"][0]["text"], f"plan for topic {i}")
+
+    def test_errors_are_reported_per_entry(self):
+        submit_messages = self.agent.submit_messages
+
+        def failing_submit(messages, *args, **kwargs):
+            if messages[0].parts[0].text == "topic 99":
+                raise RuntimeError("agent failure")
+            return submit_messages(messages, *args, **kwargs)
+
+        batch = [
+            send_call(1, "topic 1"),
+            "not an object",
+            {"jsonrpc": "2.0", "id": 3, "method": "tasks/unknown"},
+            {"jsonrpc": "2.0", "id": 4, "method": "message/send", "params": {"message": {"parts": "x"}}},
+            send_call(5, "topic 99"),
+        ]
+        with mock.patch.object(self.agent, "submit_messages", side_effect=failing_submit):
+            response, replies = self.post(batch)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([reply["id"] for reply in replies], [1, None, 3, 4, 5])
+        self.assertEqual(replies[0]["result"]["status"]["state"], "completed")
+        self.assertEqual(
+            [reply["error"]["code"] for reply in replies[1:]],
+            [-32600, -32601, -32602, -32603]
+        )
+
+    def test_empty_batch_is_invalid(self):
+        response, reply = self.post([])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(reply["id"])
+        self.assertEqual(reply["error"]["code"], -32600)
+
+    def test_oversized_batch_is_rejected(self):
+        batch = [send_call(i, f"topic {i}") for i in range(app_module.MAX_BATCH_SIZE + 1)]
+
+        with mock.patch.object(self.agent, "submit_messages") as submit:
+            response, reply = self.post(batch)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(reply["error"]["code"], -32600)
+        submit.assert_not_called()
+
+
+class RequestBodyTest(unittest.TestCase):
+    def test_empty_body_is_invalid_request(self):
+        client = app_module.app.test_client()
+        for path in ("/tasks/send", "/tasks/sendSubscribe"):
+            response = client.post(path, data=b"", content_type="application/json")
+            reply = orjson.loads(response.data)
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(reply["error"]["code"], -32600)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from utils import compress_query, strip_html_and_whitespace
+
+
+class StripHtmlTest(unittest.TestCase):
+    def test_block_tags_become_spaces(self):
+        self.assertEqual(strip_html_and_whitespace("<p>Hi</p><p>there</p><br />now"), "Hi there now")
+
+    def test_inline_tags_are_removed(self):
+        self.assertEqual(strip_html_and_whitespace("Learn Py<b>thon</b> <span class='x'>daily</span>"), "Learn Python daily")
+
+    def test_literal_angle_brackets_are_kept(self):
+        self.assertEqual(strip_html_and_whitespace("1 < 2 and 3 > 2"), "1 < 2 and 3 > 2")
+        self.assertEqual(
+            strip_html_and_whitespace("<p>Study <30 min, then >1h review</p>"),
+            "Study <30 min, then >1h review"
+        )
+
+    def test_entities_are_decoded(self):
+        self.assertEqual(strip_html_and_whitespace("a&nbsp;&nbsp;b &amp; &lt;c&gt;"), "a b & <c>")
+
+
+class CompressQueryTest(unittest.TestCase):
+    def test_leading_polite_framing_is_stripped(self):
+        self.assertEqual(compress_query("Please, make a study plan for calculus"), "make a study plan for calculus")
+        self.assertEqual(compress_query("Could you please make a plan? Kindly keep it short."), "make a plan? keep it short.")
+
+    def test_mid_sentence_phrases_are_kept(self):
+        self.assertEqual(compress_query("What can you do for my exams?"), "What can you do for my exams?")
+        self.assertEqual(compress_query("Tell me what I should study, please"), "Tell me what I should study, please")
+
+
+if __name__ == "__main__":
+    unittest.main()
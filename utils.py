@@ -1,59 +1,177 @@
 import re  # For HTML cleaning (add if missing)
 from typing import List, Dict, Any, Optional
 from uuid import uuid4  # If needed elsewhere
+from collections import OrderedDict
+from functools import lru_cache
 from models.a2a import A2AMessage, MessagePart
 
-def normalize_telex_message(raw_message: Dict[str, Any]) -> List[A2AMessage]:
+
+# Deterministic filler stripping applied to queries before they reach Gemini
+# Polite framing only counts at the start of the query or of a sentence, so
+# "What can you do for my exams?" keeps its "can you"
+_POLITE_RE = re.compile(
+    r"(?:^|(?<=[.!?]))(?:\s*(?:please|kindly|could you|would you|can you|i would like you to|i want you to)\b[,!]?)+",
+    re.IGNORECASE
+)
+_HEDGE_RE = re.compile(r"\b(?:it seems like|i think that|probably|possibly)\b", re.IGNORECASE)
+_VERBOSE_RE = re.compile(
+    r"\b(provide|give|create|make)(?: me)?(?: with)? (?:a |an )?(?:very )?(?:detailed|comprehensive|thorough) ",
+    re.IGNORECASE
+)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def compress_query(text: str) -> str:
+    """
+    Strips polite framing, hedging and verbose qualifiers from a user query.
+    Falls back to the original text if nothing meaningful is left.
+    """
+    compressed = _POLITE_RE.sub("", text)
+    compressed = _HEDGE_RE.sub("", compressed)
+    compressed = _VERBOSE_RE.sub(r"\1 ", compressed)
+    compressed = _SPACE_RE.sub(" ", compressed).strip(" ,")
+    return compressed or text
+
+
+# Only real tags match: '<' must be followed by a tag name, so literal
+# comparisons such as "1 < 2" or "<30 min" are left alone
+_BLOCK_TAGS = r"(?:p|br|div|li|ul|ol|h[1-6]|blockquote|pre|hr|table|tr|td|th)(?![A-Za-z0-9-])"
+_TAG_TAIL = r"(?:\s[^>]*)?/?>"
+# Inline tags (<b>, <i>, <span>, ...) are dropped without a space so
+# "Py<b>thon</b>" stays one word; block tags are left for _HTML_RE
+_INLINE_TAG_RE = re.compile(rf"</?(?!{_BLOCK_TAGS})[A-Za-z][A-Za-z0-9-]*{_TAG_TAIL}", re.IGNORECASE)
+# Runs of block tags, whitespace and &nbsp; collapse to a single space in one pass
+_HTML_RE = re.compile(rf"(?:</?{_BLOCK_TAGS}{_TAG_TAIL}|\s|&nbsp;)+", re.IGNORECASE)
+# The other entities Telex's editor emits, decoded in a single scan
+_ENTITIES = {"amp": "&", "lt": "<", "gt": ">"}
+_ENTITY_RE = re.compile(r"&(amp|lt|gt);")
+
+
+# Longer texts are cleaned without caching: they are rarely repeated and
+# would pin large strings in the cache
+STRIP_CACHE_MAX_LEN = 8192
+
+
+def strip_html_and_whitespace(text: str) -> str:
+    """
+    Removes HTML tags (block tags such as Telex's <p>/<br /> become a space,
+    inline tags vanish), collapses whitespace and decodes &nbsp;/&amp;/&lt;/&gt; with precompiled regexes.
+    Cached up to STRIP_CACHE_MAX_LEN characters: Telex resends the same
+    history items on every turn.
+    """
+    if len(text) > STRIP_CACHE_MAX_LEN:
+        return _strip_html_and_whitespace(text)
+    return _cached_strip_html_and_whitespace(text)
+
+
+def _strip_html_and_whitespace(text: str) -> str:
+    # Plain text: no tags or entities, and the only whitespace is single
+    # spaces (isprintable() is False for every other whitespace character)
+    if "<" not in text and "&" not in text and "  " not in text and text.isprintable():
+        return text.strip(" ")
+    if "<" in text:
+        text = _INLINE_TAG_RE.sub("", text)
+    text = _HTML_RE.sub(" ", text)
+    text = _ENTITY_RE.sub(lambda m: _ENTITIES[m.group(1)], text)
+    return text.strip()
+
+
+_cached_strip_html_and_whitespace = lru_cache(maxsize=4096)(_strip_html_and_whitespace)
+
+
+class LRUCache(OrderedDict):
+    """Dict bounded to `maxsize` entries that evicts the least recently used key."""
+
+    def __init__(self, maxsize: int = 1024):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+# Most recent Telex history items kept from a data part
+TELEX_HISTORY_ITEMS = 3
+
+
+def normalize_telex_message(raw_message: Dict[str, Any], history_items: int = TELEX_HISTORY_ITEMS) -> List[A2AMessage]:
     """
     Normalizes Telex's new parts format: parts[0] = query, data = history chunks.
+    Only the last `history_items` history chunks are cleaned and kept.
     Returns a clean list of A2AMessage for your agent.
     """
-    messages = []
-    
     # Debug: Log raw_message structure
     # app.logger.debug(f"Normalizer input: type={type(raw_message)}, has_parts={hasattr(raw_message, 'parts') or 'parts' in raw_message}")
-    
-    parts = raw_message.get('parts', []) if isinstance(raw_message, dict) else (raw_message.parts if hasattr(raw_message, 'parts') else [])
+
+    # Dispatch on the shape once: raw JSON (raw mode) is already dicts, while
+    # a validated A2AMessage (message/send) has its parts read into dicts
+    if isinstance(raw_message, dict):
+        parts = raw_message.get('parts') or []
+    else:
+        parts = [{'kind': p.kind, 'text': p.text, 'data': p.data} for p in (getattr(raw_message, 'parts', None) or [])]
+    return _normalize_parts(parts, history_items)
+
+
+def _normalize_parts(parts: List[Dict[str, Any]], history_items: int) -> List[A2AMessage]:
+    """Builds the message list from Telex parts given as plain dicts."""
+    messages = []
     if not parts:
         # app.logger.warning("No parts in raw_message - returning empty")
         return messages
     
-    # Extract interpreted query (parts[0])
+    # Extract interpreted query (parts[0]; the guard above ensures it exists)
     query_text = ""
-    if parts and len(parts) > 0:
-        first_part = parts[0]
-        kind = first_part.get('kind') if isinstance(first_part, dict) else first_part.kind
-        text = first_part.get('text') if isinstance(first_part, dict) else first_part.text
-        if kind == 'text' and text:
-            query_text = str(text).strip()
+    first_part = parts[0]
+    text = first_part.get('text')
+    if first_part.get('kind') == 'text' and text:
+        query_text = str(text).strip()
     
-    # Flatten data part history (last 10 chunks, clean text)
-    history_texts = []
-    for part in parts:
-        # Handle part as dict or model
-        is_dict = isinstance(part, dict)
-        kind = part.get('kind') if is_dict else part.kind
-        if kind == 'data':
-            data = part.get('data') if is_dict else part.data
-            if isinstance(data, list):
-                for sub_item in data[-3:]:  # Last 10 for recency
-                    # FIX: Handle sub_item as dict (Telex raw JSON)
-                    sub_kind = sub_item.get('kind') if isinstance(sub_item, dict) else getattr(sub_item, 'kind', None)
-                    sub_text = sub_item.get('text') if isinstance(sub_item, dict) else getattr(sub_item, 'text', None)
-                    if sub_kind == 'text' and sub_text:
-                        clean_sub = str(sub_text).strip().replace('<p>', '').replace('</p>', '').replace('<br />', ' ')
-                        if clean_sub and clean_sub not in history_texts:
-                            history_texts.append(clean_sub)
+    # Flatten data part history (last few chunks, clean text). Telex sends a
+    # single data part holding the history list; find it once
+    history_texts = ()
+    data = next(
+        (part['data'] for part in parts if part.get('kind') == 'data' and isinstance(part.get('data'), list)),
+        None
+    )
+    if data:
+        # A dict is an insertion-ordered set: one structure dedupes and keeps order
+        kept = {}
+        # Walk back from the newest item and stop once enough unique
+        # texts are kept, so older items are never cleaned
+        for sub_item in reversed(data):
+            if len(kept) >= history_items:
+                break
+            # History items are raw JSON objects; skip anything else
+            if not isinstance(sub_item, dict):
+                continue
+            sub_text = sub_item.get('text')
+            if sub_item.get('kind') == 'text' and sub_text:
+                clean_sub = strip_html_and_whitespace(str(sub_text))
+                if clean_sub:
+                    kept.setdefault(clean_sub)
+        history_texts = reversed(kept)
     
-    # Build history messages (alternating roles from history, starting with user)
+    # Build history messages (alternating roles from history, starting with user).
+    # Every field is a cleaned str or a literal, so validation is skipped
     full_history = []
     for i, text in enumerate(history_texts):
         role = 'user' if i % 2 == 0 else 'agent'  # Start with user for history
-        full_history.append(A2AMessage(role=role, parts=[MessagePart(kind="text", text=text)]))
+        full_history.append(A2AMessage.model_construct(role=role, parts=[MessagePart.model_construct(kind="text", text=text)]))
     
     # Add new query as last user message if present
     if query_text:
-        full_history.append(A2AMessage(role="user", parts=[MessagePart(kind="text", text=query_text)]))
+        full_history.append(A2AMessage.model_construct(role="user", parts=[MessagePart.model_construct(kind="text", text=query_text)]))
     
     messages = full_history
     